@@ -1,8 +1,16 @@
 import os
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 import time
+import calendar
+import random
+import shutil
+import sqlite3
+import threading
+import functools
+import logging
 import concurrent.futures
-from datetime import datetime
 from dotenv import load_dotenv
 from canvasapi import Canvas
 
@@ -16,207 +24,446 @@ COURSE_ID = os.getenv("CANVAS_COURSE_ID")
 
 # Configuration options
 INCLUDE_ALL_SUBMISSIONS = True  # Set to False to download only the latest submission
-EXCLUDED_EXTENSIONS = {".mp4"} 
+EXCLUDED_EXTENSIONS = frozenset({"mp4"})  # Lowercase, without the leading dot
+MAX_CONCURRENT_REQUESTS = 20  # Cap on HTTP requests in flight across all workers
+DOWNLOAD_BUFFER_SIZE = 1 << 20  # Bytes copied per read when streaming a download
+RANGED_DOWNLOAD_THRESHOLD = 20 * 1024 * 1024  # Files at least this large are fetched in parallel ranges
+RANGED_DOWNLOAD_PARTS = 4  # Concurrent range requests per large file
+MAX_RETRIES = 5  # Attempts per download before giving up
+RETRY_BASE_DELAY = 1.0  # Seconds; backoff doubles with each attempt
+RETRY_MAX_DELAY = 30.0  # Upper bound on a single backoff
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+REQUESTS_PER_SECOND = 30  # Sustained request rate shared by all workers
+REQUEST_BURST = 30  # Requests allowed back-to-back when the bucket is full
+
+# Shared gate so the number of open connections stays bounded regardless of worker count
+HTTP_SEMAPHORE = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+class TokenBucket:
+    """Thread-safe token bucket: admits `rate` requests per second with bursts up to `capacity`"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+RATE_LIMITER = TokenBucket(REQUESTS_PER_SECOND, REQUEST_BURST)
+
+# Shared HTTP session so keep-alive connections are reused across requests
+SESSION = requests.Session()
+SESSION.headers["Authorization"] = f"Bearer {API_KEY}"
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0))
+
+# Characters that are unsafe in file and directory names on common platforms
+PATH_TRANSLATION = str.maketrans({c: "_" for c in '/\\<>:"|?*'})
+# User names additionally have spaces replaced, matching the submission filename format
+USER_NAME_TRANSLATION = str.maketrans({c: "_" for c in '/\\<>:"|?* '})
+
+class RateLimitedSession(requests.Session):
+    """Session for canvasapi's own API calls, paced and gated like the file requests"""
+    def request(self, *args, **kwargs):
+        # canvasapi reads every response body in full, so the slot is released once this returns
+        RATE_LIMITER.acquire()
+        with HTTP_SEMAPHORE:
+            return super().request(*args, **kwargs)
 
 canvas = Canvas(API_URL, API_KEY)
+# canvasapi doesn't expose its Requester, so swap in the limited session through the mangled name
+canvas_session = RateLimitedSession()
+canvas_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0))
+canvas._Canvas__requester._session = canvas_session
 course = canvas.get_course(COURSE_ID)
 assignments = course.get_assignments()
 
 # Output directory
 BASE_DIR = "submissions"
-DOWNLOAD_DIR = os.path.join(BASE_DIR, course.name.replace("/", "_")) + "_assignment_submissions"
+DOWNLOAD_DIR = os.path.join(BASE_DIR, course.name.translate(PATH_TRANSLATION)) + "_assignment_submissions"
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 # Status file for failed downloads
 STATUS_FILE = os.path.join(DOWNLOAD_DIR, "failed_downloads.txt")
 
+# Manifest of completed downloads, so re-runs can skip them without touching the filesystem
+MANIFEST_FILE = os.path.join(DOWNLOAD_DIR, "manifest.db")
+MANIFEST_COMMIT_INTERVAL = 50  # Completed downloads recorded per transaction
+MANIFEST = sqlite3.connect(MANIFEST_FILE, check_same_thread=False)
+MANIFEST.execute("CREATE TABLE IF NOT EXISTS done(key TEXT PRIMARY KEY, size INTEGER, path TEXT)")
+MANIFEST.commit()
+MANIFEST_LOCK = threading.Lock()
+manifest_pending = 0
+
+def manifest_key(assignment_id, user_id, version_num, attachment_id):
+    return f"{assignment_id}:{user_id}:{version_num}:{attachment_id}"
+
+def is_downloaded(key):
+    with MANIFEST_LOCK:
+        return MANIFEST.execute("SELECT 1 FROM done WHERE key=?", (key,)).fetchone() is not None
+
+def record_download(key, size, path):
+    """Add a completed download to the manifest, committing in batches"""
+    global manifest_pending
+    with MANIFEST_LOCK:
+        MANIFEST.execute("INSERT OR REPLACE INTO done VALUES (?, ?, ?)", (key, size, path))
+        manifest_pending += 1
+        if manifest_pending >= MANIFEST_COMMIT_INTERVAL:
+            MANIFEST.commit()
+            manifest_pending = 0
+
+# Failed downloads go through a locked, persistent handler instead of reopening the file per failure
+failed_logger = logging.getLogger("failed_downloads")
+failed_logger.propagate = False
+failed_handler = logging.FileHandler(STATUS_FILE, delay=True)
+failed_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+failed_logger.addHandler(failed_handler)
+
 def log_failed_download(file_name, url, status_code):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(STATUS_FILE, "a") as f:
-        f.write(f"[{timestamp}] Failed: {file_name}, URL: {url}, Status Code: {status_code}\n")
-
-def download_file(url, filename):
-    headers = {"Authorization": f"Bearer {API_KEY}"}
-    retries = 3
-    while retries > 0:
-        response = requests.get(url, headers=headers, stream=True)
-        if response.status_code == 200:
-            with open(filename, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"Downloaded: {filename}")
-            return True
-        elif response.status_code == 429:
-            retry_after = int(response.headers.get("Retry-After", 5))
-            print(f"Rate limited. Retrying in {retry_after} seconds...")
-            time.sleep(retry_after)
-            retries -= 1
+    failed_logger.error("Failed: %s, URL: %s, Status Code: %s", file_name, url, status_code)
+
+def retry_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter, never shorter than the server's Retry-After"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    try:
+        return max(delay, float(retry_after or 0))
+    except ValueError:
+        return delay
+
+def remote_size(url):
+    """Return the Content-Length reported by a HEAD request, or None if unavailable"""
+    RATE_LIMITER.acquire()
+    try:
+        with HTTP_SEMAPHORE:
+            response = SESSION.head(url, allow_redirects=True, timeout=60)
+    except (requests.ConnectionError, requests.Timeout):
+        return None
+    if response.status_code != 200:
+        return None
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+def download_file(url, filename, offset=0):
+    """Download url to filename, resuming from byte `offset` of an existing partial file"""
+    status_code = None
+    for attempt in range(MAX_RETRIES):
+        headers = {"Range": f"bytes={offset}-"} if offset else None
+        retry_after = None
+        RATE_LIMITER.acquire()
+        try:
+            with HTTP_SEMAPHORE:
+                with SESSION.get(url, headers=headers, stream=True, timeout=60) as response:
+                    status_code = response.status_code
+                    if status_code in (200, 206):
+                        # 206 continues the partial file; a plain 200 means the range was ignored
+                        response.raw.decode_content = True
+                        try:
+                            with open(filename, "ab" if status_code == 206 else "wb") as f:
+                                shutil.copyfileobj(response.raw, f, length=DOWNLOAD_BUFFER_SIZE)
+                        except urllib3.exceptions.HTTPError:
+                            # Resume from what reached disk, unless the body was re-encoded in transit
+                            offset = 0 if response.headers.get("Content-Encoding") else os.path.getsize(filename)
+                            raise
+                        print(f"Downloaded: {filename}")
+                        return True
+                    retry_after = response.headers.get("Retry-After")
+        except (requests.ConnectionError, requests.Timeout, urllib3.exceptions.HTTPError) as e:
+            status_code = type(e).__name__
         else:
-            print(f"Failed to download {filename}: {response.status_code}")
-            log_failed_download(filename, url, response.status_code)
-            return False
+            if status_code not in RETRY_STATUS_CODES:
+                break
+        if attempt < MAX_RETRIES - 1:
+            sleep_s = retry_delay(attempt, retry_after)
+            print(f"Request for {filename} failed ({status_code}). Retrying in {sleep_s:.1f} seconds...")
+            time.sleep(sleep_s)
+    print(f"Failed to download {filename}: {status_code}")
+    log_failed_download(filename, url, status_code)
     return False
 
-def get_submission_detail(assignment_id, user_id):
-    """Fetch the latest submission details for a specific user and assignment"""
-    url = f"{API_URL}/api/v1/courses/{COURSE_ID}/assignments/{assignment_id}/submissions/{user_id}"
-    params = {"include[]": "attachments"}
-    headers = {"Authorization": f"Bearer {API_KEY}"}
-    
-    response = requests.get(url, headers=headers, params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch submission details: {response.status_code}")
-        return None
+def download_range(url, fd, start, end):
+    """Fetch bytes start..end (inclusive) of url and write them at the same offset of fd"""
+    RATE_LIMITER.acquire()
+    try:
+        with HTTP_SEMAPHORE:
+            with SESSION.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=60) as response:
+                if response.status_code != 206:
+                    return False
+                offset = start
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_BUFFER_SIZE):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+    except (requests.RequestException, OSError):
+        return False
+    return offset == end + 1
 
-def get_all_submission_versions(assignment_id, user_id):
-    """Fetch all submission versions for a specific user and assignment"""
-    url = f"{API_URL}/api/v1/courses/{COURSE_ID}/assignments/{assignment_id}/submissions/{user_id}"
-    params = {"include[]": "submission_history"}
-    headers = {"Authorization": f"Bearer {API_KEY}"}
+def download_ranged(url, filename, size):
+    """Download a large file as parallel range requests into a preallocated file"""
+    # Fill a temporary file so a preallocated, partly written file never sits under the final name
+    part_path = filename + ".part"
+    completed = False
+    try:
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            bounds = [(i * size // RANGED_DOWNLOAD_PARTS, (i + 1) * size // RANGED_DOWNLOAD_PARTS - 1)
+                      for i in range(RANGED_DOWNLOAD_PARTS)]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=RANGED_DOWNLOAD_PARTS) as part_executor:
+                results = list(part_executor.map(lambda b: download_range(url, fd, *b), bounds))
+        finally:
+            os.close(fd)
+        if all(results):
+            os.replace(part_path, filename)
+            completed = True
+    except OSError as e:
+        print(f"Could not write {part_path}: {e}")
+    finally:
+        if not completed and os.path.exists(part_path):
+            os.remove(part_path)
     
-    response = requests.get(url, headers=headers, params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch submission versions: {response.status_code}")
-        return None
+    if completed:
+        print(f"Downloaded: {filename}")
+        return True
+    
+    print(f"Ranged download of {filename} failed, retrying as a single stream")
+    return download_file(url, filename)
 
 def format_date(date_str):
     """Format date string from Canvas API"""
     if not date_str:
         return "no_date"
-    try:
-        return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y%m%d_%H%M%S")
-    except ValueError:
+    # Canvas timestamps are fixed-width (YYYY-MM-DDTHH:MM:SSZ), so slice instead of parsing
+    if (len(date_str) != 20 or date_str[4] != "-" or date_str[7] != "-" or date_str[10] != "T"
+            or date_str[13] != ":" or date_str[16] != ":" or date_str[19] != "Z"):
         return "invalid_date"
+    date_part = f"{date_str[0:4]}{date_str[5:7]}{date_str[8:10]}"
+    time_part = f"{date_str[11:13]}{date_str[14:16]}{date_str[17:19]}"
+    if not (date_part + time_part).isascii() or not (date_part + time_part).isdigit():
+        return "invalid_date"
+    # Reject out-of-range fields, as strptime would
+    year, month, day = int(date_part[0:4]), int(date_part[4:6]), int(date_part[6:8])
+    if (year < 1 or not 1 <= month <= 12 or not 1 <= day <= calendar.monthrange(year, month)[1]
+            or int(time_part[0:2]) > 23 or int(time_part[2:4]) > 59 or int(time_part[4:6]) > 59):
+        return "invalid_date"
+    return f"{date_part}_{time_part}"
+
+@functools.lru_cache(maxsize=None)
+def lookup_user_name(user_id):
+    """Fetch a user's name once per run for submissions that arrive without user info"""
+    # Errors propagate so a failed lookup isn't cached and is retried for the next submission
+    return course.get_user(user_id).name.translate(USER_NAME_TRANSLATION)
 
-def process_submission(submission, assignment_dir, assignment_id):
-    """Process student submission(s) based on configuration"""
-    time.sleep(0.5)  # Delay to reduce API load
+def process_submission(submission, assignment_dir, download_executor):
+    """Process student submission(s) based on configuration, returning the queued download futures"""
+    # User and submission history arrive embedded in the submission listing
+    user = getattr(submission, 'user', None)
+    user_id = submission.user_id
+    if user:
+        user_name = user['name'].translate(USER_NAME_TRANSLATION)
+    else:
+        try:
+            user_name = lookup_user_name(user_id)
+        except Exception as e:
+            print(f"Error fetching user info for user ID {user_id}: {e}")
+            user_name = f"user_{user_id}"
     
-    # Get the user information
-    try:
-        user = course.get_user(submission.user_id)
-        user_name = user.name.replace(' ', '_')
-        user_id = user.id
-    except Exception as e:
-        print(f"Error fetching user info for user ID {submission.user_id}: {e}")
-        user_name = f"user_{submission.user_id}"
-        user_id = submission.user_id
+    submission_history = getattr(submission, 'submission_history', None)
+    if not submission_history:
+        print(f"No submission history available for {user_name} (ID: {user_id})")
+        return []
+    
+    futures = []
     
     if INCLUDE_ALL_SUBMISSIONS:
-        # Get all submission versions for this student
-        all_versions = get_all_submission_versions(assignment_id, user_id)
-        
-        if not all_versions or 'submission_history' not in all_versions:
-            print(f"No submission history available for {user_name} (ID: {user_id})")
-            
-            # Try processing just the current submission if it has attachments
-            if hasattr(submission, 'attachments') and submission.attachments:
-                process_attachments(submission.attachments, user_name, user_id, 1, 
-                                  format_date(submission.submitted_at), assignment_dir)
-            return
-        
         # Process each version in the submission history
-        submission_history = all_versions['submission_history']
-        
         print(f"Found {len(submission_history)} submission versions for {user_name}")
         
         for version_idx, version in enumerate(submission_history):
             version_num = version_idx + 1
-            submitted_at = format_date(version.get('submitted_at', None))
+            try:
+                submitted_at = format_date(version['submitted_at'])
+            except KeyError as e:
+                print(f"Skipping version {version_num} with missing field {e} for {user_name} (ID: {user_id})")
+                log_failed_download(f"{user_name}_{user_id}_v{version_num}", None, f"missing {e}")
+                continue
             
             # Check if this version has attachments
-            if 'attachments' in version and version['attachments']:
-                process_attachments(version['attachments'], user_name, user_id, 
-                                  version_num, submitted_at, assignment_dir)
+            attachments = version.get('attachments')
+            if attachments:
+                futures.extend(process_attachments(attachments, user_name, user_id, version_num, submitted_at,
+                                                   assignment_dir, submission.assignment_id, download_executor))
             else:
                 print(f"No attachments in version {version_num} for {user_name} (ID: {user_id})")
     else:
-        # Process only the latest submission
+        # Process only the latest submission (the last entry in the history)
         version_num = 1  # Always mark as version 1 for latest-only mode
-        submitted_at = format_date(getattr(submission, 'submitted_at', None))
-        
-        # Get the current submission directly from the API to ensure we have the attachments
-        latest_submission = get_submission_detail(assignment_id, user_id)
+        latest_submission = submission_history[-1]
+        try:
+            submitted_at = format_date(latest_submission['submitted_at'])
+        except KeyError as e:
+            print(f"Skipping latest submission with missing field {e} for {user_name} (ID: {user_id})")
+            log_failed_download(f"{user_name}_{user_id}_v{version_num}", None, f"missing {e}")
+            return futures
         
-        if latest_submission and 'attachments' in latest_submission and latest_submission['attachments']:
+        attachments = latest_submission.get('attachments')
+        if attachments:
             print(f"Processing latest submission for {user_name} (ID: {user_id})")
-            process_attachments(latest_submission['attachments'], user_name, user_id, 
-                              version_num, submitted_at, assignment_dir)
+            futures.extend(process_attachments(attachments, user_name, user_id, version_num, submitted_at,
+                                               assignment_dir, submission.assignment_id, download_executor))
         else:
             print(f"No attachments in latest submission for {user_name} (ID: {user_id})")
+    return futures
 
-def process_attachments(attachments, user_name, user_id, version_num, submitted_at, assignment_dir):
-    """Process and download attachments for a submission version"""
-    files_downloaded = 0
+def fetch_attachment(url, file_path, offset, size, key):
+    """Download one attachment, splitting large fresh downloads into parallel ranges"""
+    if offset == 0 and size and size >= RANGED_DOWNLOAD_THRESHOLD and hasattr(os, "pwrite"):
+        downloaded = download_ranged(url, file_path, size)
+    else:
+        downloaded = download_file(url, file_path, offset)
+    if downloaded:
+        record_download(key, os.path.getsize(file_path), file_path)
+    return downloaded
+
+def process_attachments(attachments, user_name, user_id, version_num, submitted_at, assignment_dir, assignment_id,
+                        download_executor):
+    """Queue the attachments of a submission version for download, returning their futures"""
+    futures = []
     
     for attachment in attachments:
-        # Get the file extension
-        file_ext = os.path.splitext(attachment['filename'])[1].lower() if 'filename' in attachment else ""
-        
-        if file_ext in EXCLUDED_EXTENSIONS:
-            print(f"Skipping file (excluded type): {attachment.get('filename', 'unknown')}")
+        try:
+            filename = attachment['filename']
+            
+            # Skip excluded file types before doing any other work
+            _, dot, file_ext = filename.rpartition('.')
+            if dot and file_ext.lower() in EXCLUDED_EXTENSIONS:
+                print(f"Skipping file (excluded type): {filename}")
+                continue
+            
+            # Create a descriptive filename including version and timestamp
+            file_name = f"{user_name}_{user_id}_v{version_num}_{submitted_at}_{filename}"
+            file_path = os.path.join(assignment_dir, file_name)
+            
+            url = attachment['url']
+            key = manifest_key(assignment_id, user_id, version_num, attachment['id'])
+        except KeyError as e:
+            print(f"Skipping attachment with missing field {e} for {user_name} (ID: {user_id})")
+            log_failed_download(f"{user_name}_{user_id}_v{version_num}_{submitted_at}", None, f"missing {e}")
             continue
         
-        # Create a descriptive filename including version and timestamp
-        file_name = f"{user_name}_{user_id}_v{version_num}_{submitted_at}_{attachment.get('filename', 'unnamed')}"
-        file_path = os.path.join(assignment_dir, file_name)
+        if is_downloaded(key):
+            print(f"File already downloaded, skipping: {file_name}")
+            continue
         
-        # Check if file already exists
+        # Not in the manifest: skip files already complete on disk, resume ones that are partial
+        size = attachment.get('size')
+        offset = 0
         if os.path.exists(file_path):
-            print(f"File already exists, skipping: {file_name}")
-            continue
+            local_size = os.path.getsize(file_path)
+            expected_size = size if size is not None else remote_size(url)
+            if expected_size is not None and local_size == expected_size:
+                print(f"File already exists, skipping: {file_name}")
+                record_download(key, local_size, file_path)
+                continue
+            if expected_size is not None and local_size < expected_size:
+                print(f"Resuming partial download of {file_name} at byte {local_size}")
+                offset = local_size
         
-        # Download the file
-        if download_file(attachment.get('url', None), file_path):
-            files_downloaded += 1
+        # Hand the transfer to the download pool so large files don't hold up metadata work
+        futures.append(download_executor.submit(fetch_attachment, url, file_path, offset, size, key))
+    
+    if futures:
+        print(f"Queued {len(futures)} files for version {version_num} ({user_name})")
+    return futures
+
+def queue_assignment(assignment, metadata_executor, download_executor):
+    """List an assignment's submissions and queue each one for processing"""
+    print(f"\nProcessing published assignment: {assignment.name} (ID: {assignment.id})")
+    print(f"Mode: {'All submission versions' if INCLUDE_ALL_SUBMISSIONS else 'Latest submissions only'}")
     
-    if files_downloaded > 0:
-        print(f"Downloaded {files_downloaded} files for version {version_num} ({user_name})")
+    # Create directory for this assignment
+    assignment_dir = os.path.join(DOWNLOAD_DIR, f"{assignment.name.translate(PATH_TRANSLATION)}_{assignment.id}")
+    os.makedirs(assignment_dir, exist_ok=True)
+    
+    # Get all submissions for this assignment
+    futures = []
+    try:
+        submissions = assignment.get_submissions(include=['submission_history', 'user'])
+        
+        for submission in submissions:
+            futures.append(
+                metadata_executor.submit(process_submission, submission, assignment_dir, download_executor)
+            )
+        print(f"Found {len(futures)} student submissions for assignment {assignment.name}")
+    except Exception as e:
+        print(f"Error retrieving submissions for assignment {assignment.name}: {e}")
+    return futures
 
-# Filter only assignments (excluding quizzes)
-valid_assignments = [
+# Filter only assignments (excluding quizzes), lazily so pages are fetched as they are consumed
+valid_assignments = (
     assignment for assignment in assignments
     if "online_quiz" not in assignment.submission_types  # Exclude quizzes
-]
+)
 
-# Download submissions for all PUBLISHED assignments with controlled concurrency
-MAX_WORKERS = 30 # set appropriate number of workers based on API rate limits
-with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-    futures = []
+# Download submissions for all PUBLISHED assignments with controlled concurrency.
+# Metadata work (small API responses) and file transfers use separate pools so large
+# downloads can't occupy every worker; tune both to your Canvas rate limits.
+META_WORKERS = int(os.getenv("META_WORKERS", 30))
+DL_WORKERS = int(os.getenv("DL_WORKERS", 8))
+LISTING_WORKERS = 4  # Assignments whose submissions are listed concurrently
+# Listings get their own pool so they never wait behind queued submission work
+with concurrent.futures.ThreadPoolExecutor(max_workers=META_WORKERS) as metadata_executor, \
+        concurrent.futures.ThreadPoolExecutor(max_workers=DL_WORKERS) as download_executor, \
+        concurrent.futures.ThreadPoolExecutor(max_workers=LISTING_WORKERS) as listing_executor:
+    listing_futures = []
     
     for assignment in valid_assignments:
         # Only process published assignments
         if assignment.published:
-            print(f"\nProcessing published assignment: {assignment.name} (ID: {assignment.id})")
-            print(f"Mode: {'All submission versions' if INCLUDE_ALL_SUBMISSIONS else 'Latest submissions only'}")
-            
-            # Create directory for this assignment
-            assignment_dir = os.path.join(DOWNLOAD_DIR, f"{assignment.name.replace('/', '_')}_{assignment.id}")
-            os.makedirs(assignment_dir, exist_ok=True)
-            
-            # Get all submissions for this assignment
-            try:
-                submissions = assignment.get_submissions()
-                print(f"Found {len(list(submissions))} student submissions for assignment {assignment.name}")
-                
-                for submission in submissions:
-                    futures.append(
-                        executor.submit(process_submission, submission, assignment_dir, assignment.id)
-                    )
-            except Exception as e:
-                print(f"Error retrieving submissions for assignment {assignment.name}: {e}")
+            listing_futures.append(
+                listing_executor.submit(queue_assignment, assignment, metadata_executor, download_executor)
+            )
         else:
             print(f"Skipping unpublished assignment: {assignment.name}")
     
-    # Wait for all tasks to complete
-    for future in concurrent.futures.as_completed(futures):
+    # Collect the submission tasks as each assignment finishes listing
+    submission_futures = []
+    for listing_future in concurrent.futures.as_completed(listing_futures):
+        submission_futures.extend(listing_future.result())
+    
+    # Collect the download tasks as each submission is processed
+    download_futures = []
+    for future in concurrent.futures.as_completed(submission_futures):
         try:
-            future.result()
+            download_futures.extend(future.result())
         except Exception as e:
             print(f"An error occurred during processing: {e}")
+    
+    # Wait for all downloads to complete
+    files_downloaded = 0
+    for future in concurrent.futures.as_completed(download_futures):
+        try:
+            files_downloaded += future.result()
+        except Exception as e:
+            print(f"An error occurred during download: {e}")
+
+with MANIFEST_LOCK:
+    MANIFEST.commit()
+    MANIFEST.close()
+failed_handler.close()
 
-print("\nDownload complete. Check 'failed_downloads.txt' for any failed downloads.")
\ No newline at end of file
+print(f"\nDownloaded {files_downloaded} files.")
+print("Download complete. Check 'failed_downloads.txt' for any failed downloads.")
\ No newline at end of file